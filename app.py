@@ -1,5 +1,14 @@
+import atexit
+import concurrent.futures
+import functools
+import io
 import os
-import json
+import re
+import tempfile
+import threading
+import numpy as np
+import orjson
+import zstandard as zstd
 import streamlit as st
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -17,7 +26,11 @@ st.set_page_config(
 # --- CONSTANTS ---
 # Token Optimization: Only keep the last 20 messages in the context window.
 # Older messages remain on disk but are removed from the active memory.
-MAX_HISTORY_LENGTH = 20 
+MAX_HISTORY_LENGTH = 20
+
+# Render Optimization: Re-emitting every markdown element on each rerun
+# stalls long sessions, so only the newest messages are rendered by default.
+MAX_RENDER = 30
 
 # --- API SECURITY CHECK ---
 API_KEY = os.getenv("GEMINI_API_KEY")
@@ -35,53 +48,295 @@ except Exception as e:
 
 # --- 2. ROBUST FILE HANDLING ---
 
+# Write buffering: new records accumulate in memory and are flushed to disk
+# in one write+fsync per batch (~4 turns of 2 records each) instead of one
+# syscall pair per turn. Trade-off: a hard crash can lose up to one
+# unflushed batch; consolidation points (exit, clear, export) flush early.
+FLUSH_THRESHOLD = 8
+
+# Archive rolling: the live JSONL file stays small and append-friendly;
+# once it exceeds ARCHIVE_THRESHOLD records, everything but the newest
+# ARCHIVE_KEEP_LIVE is compressed into a zstd archive. Chat transcripts
+# are highly repetitive JSON, so level 3 typically shrinks them 5-10x.
+ARCHIVE_THRESHOLD = 1000
+ARCHIVE_KEEP_LIVE = 200
+
+# Pending serialized JSONL lines per lang_code. Module-level (not
+# session_state) so the atexit hook can still reach it at shutdown.
+_pending_writes = {}
+_flush_lock = threading.Lock()
+
+# Single worker so flushes stay ordered; the UI thread only serializes and
+# buffers, then hands the disk I/O off here.
+_save_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def append_history(record_line: bytes, lang_code: str):
+    """Buffers one serialized history line for a later flush."""
+    _pending_writes.setdefault(lang_code, []).append(record_line)
+
+def flush_history(lang_code: str):
+    """Writes all buffered lines for lang_code in one write+fsync.
+
+    Safe to call from the background save worker and the UI thread; the
+    lock and the batch snapshot keep concurrent appends from being lost
+    or written twice.
+    """
+    with _flush_lock:
+        pending = _pending_writes.get(lang_code)
+        if not pending:
+            return
+        batch = list(pending)
+        filename = get_history_filename(lang_code)
+        try:
+            with open(filename, "ab") as f:
+                f.writelines(batch)
+                f.flush()
+                os.fsync(f.fileno())
+            del pending[:len(batch)]
+            _roll_archive_if_needed(lang_code)
+        except OSError as e:
+            # Keep the buffer so the next flush retries the same lines.
+            print(f"Error: Could not flush history - {e}")
+
+def _roll_archive_if_needed(lang_code: str):
+    """Moves old live records into the compressed archive once the live
+    JSONL file grows past ARCHIVE_THRESHOLD lines.
+
+    The archive is append-only zstd frames; the live tail is rewritten
+    atomically, so a crash between the two steps can at worst duplicate
+    records in the archive, never lose them.
+    """
+    filename = get_history_filename(lang_code)
+    try:
+        with open(filename, "rb") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+    if len(lines) <= ARCHIVE_THRESHOLD:
+        return
+    old_lines = lines[:-ARCHIVE_KEEP_LIVE]
+    live_tail = lines[-ARCHIVE_KEEP_LIVE:]
+    try:
+        compressor = zstd.ZstdCompressor(level=3)
+        with open(get_archive_filename(lang_code), "ab") as af:
+            with compressor.stream_writer(af, closefd=False) as writer:
+                for line in old_lines:
+                    writer.write(line)
+            af.flush()
+            os.fsync(af.fileno())
+        _write_file_atomic(filename, live_tail)
+    except OSError as e:
+        print(f"Error: Could not roll history archive - {e}")
+
+def _read_archived_history(lang_code: str):
+    """Streams records out of the compressed archive; [] if there is none."""
+    records = []
+    try:
+        with open(get_archive_filename(lang_code), "rb") as af:
+            reader = zstd.ZstdDecompressor().stream_reader(af, read_across_frames=True)
+            for line in io.BufferedReader(reader):
+                line = line.strip()
+                if line:
+                    records.append(orjson.loads(line))
+    except FileNotFoundError:
+        return []
+    except (OSError, zstd.ZstdError, orjson.JSONDecodeError) as e:
+        print(f"Error: Could not read history archive - {e}")
+    return records
+
+def _flush_all_pending():
+    for lang_code in list(_pending_writes):
+        flush_history(lang_code)
+
+def _shutdown_persistence():
+    """Drains in-flight background flushes, then flushes what remains."""
+    _save_executor.shutdown(wait=True)
+    _flush_all_pending()
+
+atexit.register(_shutdown_persistence)
+
+def _write_file_atomic(filename: str, lines):
+    """Writes lines to a temp file, fsyncs, then renames over the target.
+
+    A crash mid-write can never leave a half-written history file; the
+    rename is the only point where the target changes, and it is atomic.
+    """
+    directory = os.path.dirname(filename) or "."
+    with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as f:
+        tmp_name = f.name
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+
+# C-implemented substitution instead of a per-character Python predicate
+# loop; the lru_cache below short-circuits repeat calls entirely.
+_SAFE_RE = re.compile(r"[^A-Za-z0-9]+")
+
+@functools.lru_cache(maxsize=32)
 def get_history_filename(lang_code: str) -> str:
-    """Generates a safe filename for the language history."""
-    safe_name = "".join(c for c in lang_code if c.isalnum())
-    return f"history_{safe_name}.json"
+    """Generates a safe filename for the language history.
+
+    Cached: sanitization is pure and this runs several times per rerun on
+    the keystroke path.
+    """
+    return f"history_{_SAFE_RE.sub('', lang_code)}.jsonl"
+
+@functools.lru_cache(maxsize=32)
+def get_legacy_history_filename(lang_code: str) -> str:
+    """Filename of the old full-rewrite JSON format (pre-JSONL)."""
+    return f"history_{_SAFE_RE.sub('', lang_code)}.json"
+
+@functools.lru_cache(maxsize=32)
+def get_archive_filename(lang_code: str) -> str:
+    """Filename of the compressed cold-history archive."""
+    return f"history_{_SAFE_RE.sub('', lang_code)}.archive.jsonl.zst"
+
+@functools.lru_cache(maxsize=32)
+def get_cold_start_cache_filename(lang_code: str) -> str:
+    """Filename of the cached first tutor message for a language."""
+    return f"cold_start_cache_{_SAFE_RE.sub('', lang_code)}.txt"
+
+@functools.lru_cache(maxsize=32)
+def get_semantic_cache_filename(lang_code: str) -> str:
+    """Filename of the persisted semantic-cache prompts and responses."""
+    return f"semantic_cache_{_SAFE_RE.sub('', lang_code)}.json"
+
+@functools.lru_cache(maxsize=32)
+def get_semantic_cache_matrix_filename(lang_code: str) -> str:
+    """Filename of the persisted semantic-cache embedding matrix."""
+    return f"semantic_cache_{_SAFE_RE.sub('', lang_code)}.npy"
 
 def save_history_safe(history, lang_code: str):
-    """Saves the chat history to a JSON file (Atomic write simulation)."""
-    filename = get_history_filename(lang_code)
-    history_data = []
+    """Appends only the not-yet-persisted messages to the JSONL history file.
+
+    Rewriting the full history on every turn is O(N) per message; slicing
+    against the cursor serializes only the one or two new messages, keeping
+    each save O(1) regardless of session length. Records are buffered and
+    flushed in batches (see FLUSH_THRESHOLD).
+    """
+    cursor = st.session_state.get("history_cursor", 0)
     try:
-        for message in history:
-            role = message.role
-            parts_content = []
-            for part in message.parts:
-                if hasattr(part, "text"):
-                    parts_content.append({"text": part.text})
-                else:
-                    parts_content.append({"text": str(part)})
-            history_data.append({"role": role, "parts": parts_content})
-
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(history_data, f, ensure_ascii=False, indent=2)
+        # Single comprehension instead of nested append loops: fewer method
+        # lookups per part, which is the dominant cost on long histories.
+        new_records = [
+            {
+                "role": message.role,
+                "parts": [
+                    {"text": text if (text := getattr(part, "text", None)) is not None else str(part)}
+                    for part in message.parts
+                ],
+            }
+            for message in history[cursor:]
+        ]
+
+        if not new_records:
+            return
+
+        for record in new_records:
+            append_history(orjson.dumps(record) + b"\n", lang_code)
+
+        # Advance the cursor once the records are buffered; if serialization
+        # raised, the same slice is retried on the next save instead of
+        # being silently dropped.
+        st.session_state.history_cursor = cursor + len(new_records)
+
+        if len(_pending_writes.get(lang_code, ())) >= FLUSH_THRESHOLD:
+            # Hand the write+fsync to the background worker so the reply
+            # renders without waiting on disk.
+            _save_executor.submit(flush_history, lang_code)
     except Exception as e:
         print(f"Error: Could not save history - {e}")
 
+def _history_mtime(lang_code: str) -> float:
+    """Last-modified time of the history file; 0.0 if it does not exist."""
+    try:
+        return os.path.getmtime(get_history_filename(lang_code))
+    except OSError:
+        return 0.0
+
 def load_history_safe(lang_code: str):
-    """Loads history from JSON with error handling for corrupted files."""
+    """Loads history from JSONL, streaming line by line.
+
+    Falls back to (and migrates) the legacy single-document JSON format.
+    Results are cached per (lang_code, mtime) so reruns that did not touch
+    the file skip the disk read entirely.
+    """
+    # Consolidation point: turns still sitting in the write buffer must be
+    # on disk before the read, or a language switch-and-back would reload a
+    # stale file and replay the cold start over the orphaned turns.
+    flush_history(lang_code)
+    try:
+        # EAFP: one stat() doubles as both the existence check and the
+        # cache key.
+        mtime = os.path.getmtime(get_history_filename(lang_code))
+    except OSError:
+        return _load_and_migrate_legacy(lang_code)
+    return _load_history_cached(lang_code, mtime)
+
+@st.cache_data(show_spinner=False)
+def _load_history_cached(lang_code: str, mtime: float):
+    """Parses archive + live JSONL history; mtime is part of the cache key.
+
+    Rolling rewrites the live file, so its mtime also keys the archive.
+    """
     filename = get_history_filename(lang_code)
-    if not os.path.exists(filename):
+    try:
+        records = _read_archived_history(lang_code)
+        with open(filename, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(orjson.loads(line))
+        return records
+    except FileNotFoundError:
+        return []
+    except orjson.JSONDecodeError:
+        return []
+    except Exception as e:
+        st.error(f"File read error: {e}")
         return []
+
+def _load_and_migrate_legacy(lang_code: str):
+    """Reads the old history_<lang>.json format and converts it to JSONL."""
+    legacy_filename = get_legacy_history_filename(lang_code)
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
+        with open(legacy_filename, "rb") as f:
+            records = orjson.loads(f.read())
+    except FileNotFoundError:
+        return []
+    except orjson.JSONDecodeError:
         return []
     except Exception as e:
         st.error(f"File read error: {e}")
         return []
+    try:
+        filename = get_history_filename(lang_code)
+        lines = [orjson.dumps(record) + b"\n" for record in records]
+        _write_file_atomic(filename, lines)
+        os.remove(legacy_filename)
+    except OSError:
+        pass
+    return records
 
 def clear_current_history(lang_code: str):
     """Deletes the specific history file for the selected language."""
-    filename = get_history_filename(lang_code)
-    if os.path.exists(filename):
-        try:
-            os.remove(filename)
-        except OSError:
-            pass
+    # Under the flush lock so an in-flight background flush cannot
+    # recreate the file (and resurrect cleared turns) mid-delete.
+    with _flush_lock:
+        _pending_writes.pop(lang_code, None)
+        for filename in (
+            get_history_filename(lang_code),
+            get_archive_filename(lang_code),
+            get_legacy_history_filename(lang_code),
+        ):
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                pass
+    st.session_state.history_cursor = 0
     st.session_state.chat_session = None
     st.rerun()
 
@@ -97,11 +352,76 @@ LANG_OPTIONS = {
     "English (İngilizce) 🇬🇧": "En"
 }
 
+@functools.lru_cache(maxsize=8)
+def build_system_instruction(selected_label: str) -> str:
+    """Builds the tutor persona prompt once per language and reuses it.
+
+    The same string is injected into the model and embedded in the web
+    export, so rebuilding it on every rerun is pure waste.
+    """
+    return f"""
+You are 'ProGlot', an expert {selected_label} tutor for Turkish speakers.
+IMPORTANT: This is an ongoing lesson. Remember previous mistakes and progress.
+
+RULES:
+1. Explain concepts in Turkish, but provide examples strictly in {selected_label}.
+2. Correct mistakes gently and explain the 'Why' behind the rule.
+3. End every response with an interactive question or exercise.
+4. NEVER just provide the answer; keep the dialogue active.
+
+TONE: Professional, Patient, Encouraging.
+"""
+
+@st.cache_data(show_spinner=False)
+def build_export_text(lang_code: str, selected_label: str, history_mtime: float) -> str:
+    """Builds the copy-paste text for Gemini Web; cached per history mtime."""
+    # Load FULL history from disk (not just the windowed memory)
+    full_disk_history = load_history_safe(lang_code)
+    lines = [
+        f"{'Model' if msg.get('role') == 'model' else 'Student'}: "
+        f"{msg.get('parts', [{}])[0].get('text', '')}"
+        for msg in full_disk_history
+    ]
+    return (
+        f"SYSTEM INSTRUCTION:\n{build_system_instruction(selected_label)}\n\nCHAT HISTORY:\n"
+        + "\n".join(lines)
+        + "\n\n(Please continue from here)"
+    )
+
 # Initialize default selection to prevent state errors
 if "selected_label_key" not in st.session_state:
     st.session_state.selected_label_key = list(LANG_OPTIONS.keys())[0]
 
 # --- 4. UI & STATE MANAGEMENT ---
+
+# Sidebar fragments: interactions inside these blocks rerun only the block
+# itself instead of the whole script (history load, transcript render, ...).
+
+@st.fragment
+def clear_history_panel(lang_code: str):
+    """Clear-history confirm box; keystrokes here stay inside the fragment."""
+    st.warning("This action cannot be undone!")
+    confirm_text = st.text_input("Type 'delete' to confirm:", key="delete_confirm")
+    if st.button("Confirm Delete", type="primary"):
+        if confirm_text.strip().lower() == "delete":
+            clear_current_history(lang_code)
+        else:
+            st.error("Please type 'delete'.")
+
+@st.fragment
+def export_panel(lang_code: str, selected_label: str):
+    """Export-to-web block; the toggle reruns only this fragment."""
+    st.info("If API quota is exceeded, copy this text to https://gemini.google.com to continue.")
+    # Expanders do not expose their open/closed state, so an explicit
+    # toggle keeps the export build off the per-keystroke rerun path.
+    st.checkbox("Show export text", key="show_export")
+    if st.session_state.get("show_export"):
+        # Consolidation point: make sure buffered turns are on disk
+        # before the export text is built from the file.
+        flush_history(lang_code)
+        export_text = build_export_text(lang_code, selected_label, _history_mtime(lang_code))
+        st.code(export_text, language="text")
+
 with st.sidebar:
     st.header("⚙️ Control Panel")
     
@@ -120,81 +440,234 @@ with st.sidebar:
     
     # --- SAFETY SWITCH: CLEAR HISTORY ---
     with st.expander("🗑️ Clear History"):
-        st.warning("This action cannot be undone!")
-        confirm_text = st.text_input("Type 'delete' to confirm:", key="delete_confirm")
-        if st.button("Confirm Delete", type="primary"):
-            if confirm_text.strip().lower() == "delete":
-                clear_current_history(lang_code)
-            else:
-                st.error("Please type 'delete'.")
+        clear_history_panel(lang_code)
 
     # --- FEATURE: EXPORT TO WEB ---
     st.divider()
     with st.expander("🚀 Export to Gemini Web"):
-        st.info("If API quota is exceeded, copy this text to https://gemini.google.com to continue.")
-        
-        # Define the system prompt string for export
-        export_system_instruction = f"""
-You are 'ProGlot', an expert {selected_label} tutor for Turkish speakers.
-IMPORTANT: This is an ongoing lesson. Remember previous mistakes and progress.
-
-RULES:
-1. Explain concepts in Turkish, but provide examples strictly in {selected_label}.
-2. Correct mistakes gently and explain the 'Why' behind the rule.
-3. End every response with an interactive question or exercise.
-4. NEVER just provide the answer; keep the dialogue active.
-
-TONE: Professional, Patient, Encouraging.
-"""
-        # Load FULL history from disk (not just the windowed memory)
-        full_disk_history = load_history_safe(lang_code)
-        
-        export_text = f"SYSTEM INSTRUCTION:\n{export_system_instruction}\n\nCHAT HISTORY:\n"
-        for msg in full_disk_history:
-            r = "Model" if msg.get("role") == "model" else "Student"
-            txt = msg.get("parts", [{}])[0].get("text", "")
-            export_text += f"{r}: {txt}\n"
-        
-        export_text += "\n\n(Please continue from here)"
-        st.code(export_text, language="text")
+        export_panel(lang_code, selected_label)
 
     st.markdown("---")
     if st.button("🔄 Refresh UI"):
         st.rerun()
 
-# --- 5. MODEL LOGIC & INITIALIZATION ---
+# --- 5. SEMANTIC RESPONSE CACHE ---
+
+EMBEDDING_MODEL = "text-embedding-004"
+# Minimum cosine similarity for a cached reply to count as a hit.
+SEMANTIC_SIM_THRESHOLD = 0.92
+
+# Directory holding the int8-quantized MiniLM ONNX export (model.onnx +
+# tokenizer.json). When present, cache lookups cost a local matrix product
+# instead of a remote embed_content round-trip per turn.
+EMBED_MODEL_DIR = os.getenv("EMBED_MODEL_DIR", "models/minilm-l6-int8")
+
+class LocalEmbedder:
+    """int8 MiniLM sentence encoder running on onnxruntime (CPU only)."""
+
+    def __init__(self, model_dir: str):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+    def embed(self, text: str):
+        """Returns a unit-norm float32 sentence vector (mean pooling)."""
+        encoding = self._tokenizer.encode(text)
+        input_ids = np.asarray([encoding.ids], dtype=np.int64)
+        attention_mask = np.asarray([encoding.attention_mask], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self._session.run(None, inputs)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        vector = (hidden * mask).sum(axis=1)[0] / mask.sum(axis=1)[0]
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+@st.cache_resource(show_spinner=False)
+def get_local_embedder():
+    """Loads the local encoder once; None when the runtime/model is absent."""
+    try:
+        return LocalEmbedder(EMBED_MODEL_DIR)
+    except Exception:
+        return None
+
+def _quantize_unit_vector(vector):
+    """Maps a unit float vector onto int8 so N stored embeddings cost
+    N*dim bytes and similarity is one integer dot product."""
+    return np.clip(np.round(vector * 127.0), -127, 127).astype(np.int8)
+
+class SemanticCache:
+    """Two-tier cache of tutor replies keyed on the student's prompt.
+
+    Tier 1 is an exact-match dict (free lookup). Tier 2 embeds the prompt
+    and returns the reply of the nearest stored prompt when the cosine
+    similarity clears SEMANTIC_SIM_THRESHOLD — near-duplicate questions
+    like "what does X mean?" variants then skip the API call entirely.
+    Embeddings come from the local int8 encoder when available (falling
+    back to the remote API) and are stored as one (N, dim) int8 matrix so
+    the search is a single vectorized dot product. The store is persisted
+    per language, so embeddings paid for via the API survive restarts.
+    """
+
+    def __init__(self, lang_code: str):
+        self._lang_code = lang_code
+        self._exact = {}
+        self._matrix = None  # (N, dim) int8, rows aligned with _responses
+        self._responses = []
+        self._load()
+
+    def _load(self):
+        """Restores the persisted store; any damage means an empty cache."""
+        try:
+            with open(get_semantic_cache_filename(self._lang_code), "rb") as f:
+                data = orjson.loads(f.read())
+            self._exact = data.get("exact", {})
+            responses = data.get("responses", [])
+            if responses:
+                matrix = np.load(get_semantic_cache_matrix_filename(self._lang_code))
+                if matrix.shape[0] == len(responses):
+                    self._matrix = matrix
+                    self._responses = responses
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, orjson.JSONDecodeError):
+            self._exact = {}
+            self._matrix = None
+            self._responses = []
 
-# System Instruction (Injected into the Model)
-SYSTEM_INSTRUCTION = f"""
-You are 'ProGlot', an expert {selected_label} tutor for Turkish speakers.
-IMPORTANT: This is an ongoing lesson. Remember previous mistakes and progress.
+    def _save(self):
+        """Best-effort persist; a failed write only costs future hits."""
+        try:
+            _write_file_atomic(
+                get_semantic_cache_filename(self._lang_code),
+                [orjson.dumps({"exact": self._exact, "responses": self._responses})],
+            )
+            if self._matrix is not None:
+                np.save(get_semantic_cache_matrix_filename(self._lang_code), self._matrix)
+        except (OSError, ValueError):
+            pass
 
-RULES:
-1. Explain concepts in Turkish, but provide examples strictly in {selected_label}.
-2. Correct mistakes gently and explain the 'Why' behind the rule.
-3. End every response with an interactive question or exercise.
-4. NEVER just provide the answer; keep the dialogue active.
+    def _embed(self, text: str):
+        embedder = get_local_embedder()
+        if embedder is not None:
+            try:
+                return embedder.embed(text)
+            except Exception:
+                pass
+        try:
+            result = genai.embed_content(model=EMBEDDING_MODEL, content=text)
+            vector = np.asarray(result["embedding"], dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm else vector
+        except Exception:
+            # Embedding failures must never break the chat; fall through
+            # to a plain API call.
+            return None
+
+    def lookup(self, prompt: str):
+        """Returns (cached_response | None, embedding | None).
+
+        The embedding is returned so a subsequent insert() does not have
+        to re-embed the same prompt.
+        """
+        cached = self._exact.get(prompt)
+        if cached is not None:
+            return cached, None
+        embedding = self._embed(prompt)
+        if embedding is None or self._matrix is None:
+            return None, embedding
+        query = _quantize_unit_vector(embedding).astype(np.int32)
+        if query.shape[0] != self._matrix.shape[1]:
+            # A mid-session fallback from the local encoder (384 dims) to
+            # the remote model (768 dims) cannot be compared against the
+            # stored rows; treat it as a miss instead of crashing the chat.
+            return None, embedding
+        similarities = self._matrix.astype(np.int32) @ query / (127.0 * 127.0)
+        best = int(np.argmax(similarities))
+        if similarities[best] > SEMANTIC_SIM_THRESHOLD:
+            return self._responses[best], embedding
+        return None, embedding
+
+    def insert(self, prompt: str, embedding, response_text: str):
+        self._exact[prompt] = response_text
+        if embedding is not None:
+            row = _quantize_unit_vector(embedding)[None, :]
+            if self._matrix is None:
+                self._matrix = row
+                self._responses.append(response_text)
+            elif row.shape[1] == self._matrix.shape[1]:
+                self._matrix = np.vstack((self._matrix, row))
+                self._responses.append(response_text)
+            # else: mismatched dimension (see lookup) — keep the exact-match
+            # entry but do not poison the matrix with an incomparable row.
+        self._save()
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache(lang_code: str) -> SemanticCache:
+    """One cache per language so replies never leak across tutors."""
+    return SemanticCache(lang_code)
+
+def _stream_chunks(response, buffer: list):
+    """Yields streamed chunk text while keeping a copy in buffer.
+
+    The buffer lets the caller persist whatever arrived if the stream
+    dies partway through.
+    """
+    for chunk in response:
+        if chunk.text:
+            buffer.append(chunk.text)
+            yield chunk.text
+
+def _persist_partial_reply(user_input: str, partial_text: str, lang_code: str):
+    """Best-effort persistence of an interrupted turn so streamed text survives.
+
+    The records go through the shared buffer and a locked flush so any
+    earlier turns still waiting in _pending_writes land on disk first and
+    the transcript order is preserved. The chat session never recorded
+    these messages, so the history cursor is deliberately left untouched.
+    """
+    for record in (
+        {"role": "user", "parts": [{"text": user_input}]},
+        {"role": "model", "parts": [{"text": partial_text}]},
+    ):
+        append_history(orjson.dumps(record) + b"\n", lang_code)
+    flush_history(lang_code)
+
+# --- 6. MODEL LOGIC & INITIALIZATION ---
+
+# Module scope so the dict is not re-allocated on every model construction.
+GEN_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "max_output_tokens": 2048,
+}
 
-TONE: Professional, Patient, Encouraging.
-"""
+@st.cache_resource(show_spinner=False, max_entries=len(LANG_OPTIONS))
+def get_model(selected_label: str):
+    """Returns the pooled Gemini model for a language.
 
-def initialize_model():
-    """Initializes the Gemini model with specific generation config."""
-    generation_config = {
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_output_tokens": 2048,
-    }
+    One instance per language is shared across reruns and sessions; the
+    SDK object is stateless between calls, so reuse is safe.
+    """
     return genai.GenerativeModel(
         model_name=MODEL_NAME,
-        generation_config=generation_config,
-        system_instruction=SYSTEM_INSTRUCTION
+        generation_config=GEN_CONFIG,
+        system_instruction=build_system_instruction(selected_label)
     )
 
 # Main Logic: Check for language change or initialization
 if "chat_session" not in st.session_state or st.session_state.get("current_lang_code") != lang_code:
     with st.spinner(f"Loading {selected_label} history..."):
-        model = initialize_model()
+        model = get_model(selected_label)
         past_history = load_history_safe(lang_code)
         
         # --- SLIDING WINDOW LOGIC ---
@@ -212,57 +685,134 @@ if "chat_session" not in st.session_state or st.session_state.get("current_lang_
             st.session_state.chat_session = model.start_chat(history=[])
         
         st.session_state.current_lang_code = lang_code
+        # The windowed in-memory history is already on disk; only entries
+        # beyond this index need to be appended on future saves.
+        st.session_state.history_cursor = len(recent_history)
         # Mark as initialized if history exists
         st.session_state.is_initialized = len(past_history) > 0
 
-# --- 6. RENDER CHAT INTERFACE ---
+# --- 7. RENDER CHAT INTERFACE ---
 st.title(f"🌍 ProGlot AI")
 st.subheader(f"{selected_label} Tutor")
 
-# Display Chat History
-if st.session_state.chat_session:
-    for message in st.session_state.chat_session.history:
-        role = "user" if message.role == "user" else "assistant"
-        avatar = "👤" if role == "user" else "🎓"
-        with st.chat_message(role, avatar=avatar):
-            st.markdown(message.parts[0].text)
-
-# Cold Start / First Interaction Trigger
-if not st.session_state.is_initialized:
-    with st.chat_message("assistant", avatar="🎓"):
-        with st.spinner("Tutor is preparing the lesson plan..."):
-            try:
-                # Invisible prompt to start the conversation
-                response = st.session_state.chat_session.send_message(
-                    f"Start the lesson. Introduce yourself professionally in Turkish and ask for my {selected_label} proficiency level."
-                )
-                st.markdown(response.text)
+@st.fragment
+def chat_panel(lang_code: str, selected_label: str):
+    """Transcript, cold start, and input as one fragment.
+
+    A chat turn (or the load-earlier button) reruns only this block; the
+    sidebar, history load, and export code are not re-executed.
+    """
+    # Display Chat History (windowed: only the newest messages by default)
+    if st.session_state.chat_session:
+        display_history = [
+            ("user" if message.role == "user" else "assistant", message.parts[0].text)
+            for message in st.session_state.chat_session.history
+        ]
+        render_window = st.session_state.get("render_window", MAX_RENDER)
+        hidden_count = len(display_history) - render_window
+        if hidden_count > 0:
+            if st.button(f"⏫ Load earlier messages ({hidden_count} hidden)"):
+                st.session_state.render_window = render_window + MAX_RENDER
+                st.rerun(scope="fragment")
+            display_history = display_history[-render_window:]
+        for role, text in display_history:
+            avatar = "👤" if role == "user" else "🎓"
+            with st.chat_message(role, avatar=avatar):
+                st.markdown(text)
+
+    # Cold Start / First Interaction Trigger
+    if not st.session_state.is_initialized:
+        # Invisible prompt to start the conversation. It only varies in the
+        # language slot, so the tutor's opening is cached on disk per language
+        # and replayed on later launches without an API round-trip.
+        cold_start_prompt = (
+            f"Start the lesson. Introduce yourself professionally in Turkish "
+            f"and ask for my {selected_label} proficiency level."
+        )
+        cold_start_cache = get_cold_start_cache_filename(lang_code)
+        try:
+            with open(cold_start_cache, "r", encoding="utf-8") as f:
+                cached_opening = f.read()
+        except OSError:
+            cached_opening = ""
+
+        with st.chat_message("assistant", avatar="🎓"):
+            if cached_opening:
+                st.markdown(cached_opening)
+                # Inject the cached turn into a fresh session so the model
+                # still sees it as conversation context.
+                model = get_model(selected_label)
+                st.session_state.chat_session = model.start_chat(history=[
+                    {"role": "user", "parts": [{"text": cold_start_prompt}]},
+                    {"role": "model", "parts": [{"text": cached_opening}]},
+                ])
                 st.session_state.is_initialized = True
                 save_history_safe(st.session_state.chat_session.history, lang_code)
-            except Exception as e:
-                st.error(f"Initialization Error: {e}")
-
-# User Input Handling
-user_input = st.chat_input(f"Type your response in {selected_label} or Turkish...")
-
-if user_input:
-    # 1. Render User Message
-    with st.chat_message("user", avatar="👤"):
-        st.markdown(user_input)
-    
-    # 2. Render Assistant Response
-    with st.chat_message("assistant", avatar="🎓"):
-        with st.spinner("ProGlot is thinking..."):
-            try:
-                response = st.session_state.chat_session.send_message(user_input)
-                st.markdown(response.text)
-                
-                # Save the new state to disk (Simulate persistence)
+            else:
+                with st.spinner("Tutor is preparing the lesson plan..."):
+                    try:
+                        response = st.session_state.chat_session.send_message(cold_start_prompt)
+                        st.markdown(response.text)
+                        st.session_state.is_initialized = True
+                        save_history_safe(st.session_state.chat_session.history, lang_code)
+                        try:
+                            with open(cold_start_cache, "w", encoding="utf-8") as f:
+                                f.write(response.text)
+                        except OSError:
+                            pass
+                    except Exception as e:
+                        st.error(f"Initialization Error: {e}")
+
+    # User Input Handling
+    user_input = st.chat_input(f"Type your response in {selected_label} or Turkish...")
+
+    if user_input:
+        # 1. Render User Message
+        with st.chat_message("user", avatar="👤"):
+            st.markdown(user_input)
+
+        # 2. Render Assistant Response
+        with st.chat_message("assistant", avatar="🎓"):
+            semantic_cache = get_semantic_cache(lang_code)
+            cached_reply, query_embedding = semantic_cache.lookup(user_input)
+            if cached_reply is not None:
+                # Cache hit: render the stored reply without spending an API
+                # round-trip (or quota). The turn still has to survive the
+                # next rerun, so inject it into a fresh session (the same
+                # no-API-call technique as the cold-start cache) and persist.
+                st.markdown(cached_reply)
+                model = get_model(selected_label)
+                st.session_state.chat_session = model.start_chat(
+                    history=list(st.session_state.chat_session.history) + [
+                        {"role": "user", "parts": [{"text": user_input}]},
+                        {"role": "model", "parts": [{"text": cached_reply}]},
+                    ]
+                )
                 save_history_safe(st.session_state.chat_session.history, lang_code)
-            
-            except google_exceptions.ServiceUnavailable:
-                st.error("⚠️ Service Unavailable: Google servers are temporarily down.")
-            except google_exceptions.ResourceExhausted:
-                st.error("⚠️ API Quota Exceeded. Please use the 'Export to Gemini Web' feature in the sidebar.")
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
\ No newline at end of file
+            else:
+                # Stream instead of blocking on the full response: the first
+                # tokens render in hundreds of ms instead of seconds.
+                stream_buffer = []
+                try:
+                    response = st.session_state.chat_session.send_message(user_input, stream=True)
+                    st.write_stream(_stream_chunks(response, stream_buffer))
+                    reply_text = "".join(stream_buffer)
+                    semantic_cache.insert(user_input, query_embedding, reply_text)
+
+                    # Save the new state to disk (Simulate persistence)
+                    save_history_safe(st.session_state.chat_session.history, lang_code)
+
+                except google_exceptions.ServiceUnavailable:
+                    st.error("⚠️ Service Unavailable: Google servers are temporarily down.")
+                    if stream_buffer:
+                        _persist_partial_reply(user_input, "".join(stream_buffer), lang_code)
+                except google_exceptions.ResourceExhausted:
+                    st.error("⚠️ API Quota Exceeded. Please use the 'Export to Gemini Web' feature in the sidebar.")
+                    if stream_buffer:
+                        _persist_partial_reply(user_input, "".join(stream_buffer), lang_code)
+                except Exception as e:
+                    st.error(f"An error occurred: {e}")
+                    if stream_buffer:
+                        _persist_partial_reply(user_input, "".join(stream_buffer), lang_code)
+
+chat_panel(lang_code, selected_label)
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""One-shot pretty-printer for ProGlot history files.
+
+The app writes compact JSONL (and zstd archives) so the persistence hot
+path moves as few bytes as possible; when a transcript needs to be read
+by a human, re-indent it here instead of pretty-printing on every save:
+
+    python prettify_history.py history_It.jsonl
+    python prettify_history.py history_It.archive.jsonl.zst
+"""
+import io
+import json
+import sys
+
+def iter_history_lines(path: str):
+    """Yields raw JSONL lines from a plain or zstd-compressed file."""
+    if path.endswith(".zst"):
+        import zstandard as zstd
+        with open(path, "rb") as f:
+            reader = zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            yield from io.BufferedReader(reader)
+    else:
+        with open(path, "rb") as f:
+            yield from f
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(f"usage: {sys.argv[0]} <history file>")
+    for line in iter_history_lines(sys.argv[1]):
+        line = line.strip()
+        if line:
+            print(json.dumps(json.loads(line), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()